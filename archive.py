@@ -0,0 +1,417 @@
+import hashlib
+import json
+import lzma
+import os
+import struct
+import zlib
+from time import perf_counter
+
+from constants import *
+
+# optional codecs, used when the packages are installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+ARCHIVE_MAGIC = b"APLA"
+ARCHIVE_VERSION = 1
+ARCHIVE_FOOTER = "<QQ4s"  # index offset, index length, magic
+
+ENCODING_FLOAT = "f8"
+ENCODING_JSON = "json"
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+if zstandard is not None:
+    CODECS["zstd"] = (zstandard.ZstdCompressor(level=19).compress, zstandard.ZstdDecompressor().decompress)
+if lz4 is not None:
+    CODECS["lz4"] = (lambda data: lz4.frame.compress(data, compression_level=16), lz4.frame.decompress)
+
+
+def get_default_codec() -> str:
+    for codec in ("zstd", "lz4", "zlib"):
+        if codec in CODECS:
+            return codec
+
+
+def get_flight_id(content_dict: dict) -> str:
+    # identical flights (e.g. copies across the log directories) share an id
+    content_str = json.dumps(content_dict, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(content_str.encode()).hexdigest()
+
+
+def shuffle_bytes(data: bytes, width: int = 8) -> bytes:
+    # group the n-th byte of every value together, which compresses much better
+    return b"".join(data[i::width] for i in range(width))
+
+
+def unshuffle_bytes(data: bytes, width: int = 8) -> bytes:
+    out = bytearray(len(data))
+    size = len(data) // width
+    for i in range(width):
+        out[i::width] = data[i * size:(i + 1) * size]
+    return bytes(out)
+
+
+def encode_times(times: list) -> bytes:
+    deltas = [t - p for t, p in zip(times, [0] + times[:-1])]
+    return shuffle_bytes(struct.pack("<%dq" % len(deltas), *deltas))
+
+
+def decode_times(data: bytes) -> list:
+    deltas = struct.unpack("<%dq" % (len(data) // 8), unshuffle_bytes(data))
+    times = []
+    time = 0
+    for delta in deltas:
+        time += delta
+        times.append(time)
+    return times
+
+
+def encode_values(values: list, encoding: str) -> bytes:
+    if encoding == ENCODING_FLOAT:
+        return shuffle_bytes(struct.pack("<%dd" % len(values), *values))
+    return json.dumps(values).encode()
+
+
+def decode_values(data: bytes, encoding: str) -> list:
+    if encoding == ENCODING_FLOAT:
+        return list(struct.unpack("<%dd" % (len(data) // 8), unshuffle_bytes(data)))
+    return json.loads(data)
+
+
+def get_values_encoding(values: list) -> str:
+    # legacy logs store some values as lists, keep those lossless as json
+    if all(type(v) is float for v in values):
+        return ENCODING_FLOAT
+    return ENCODING_JSON
+
+
+class ArchiveWriter:
+    """
+    Writes flights as delta-encoded timestamps plus per-column compressed chunks.
+
+    Layout: magic, chunks..., compressed json index, footer. The index stores the
+    offset of every chunk (and the time range it covers), so single blocks can be
+    read without decoding the rest of the flight.
+    """
+
+    def __init__(self, path: str, codec: str = None, chunk_size: int = ARCHIVE_CHUNK_SIZE):
+        codec = get_default_codec() if codec is None else codec
+        if codec not in CODECS:
+            raise ValueError("Unsupported archive codec: %s" % codec)
+
+        self.path = path
+        self.codec = codec
+        self.compress = CODECS[codec][0]
+        self.chunk_size = chunk_size
+        self.flights = {}
+        self.names = {}
+
+        out_dir = os.path.dirname(path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        # only replace an existing archive once the new one is complete
+        self.tmp_path = path + ".tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(ARCHIVE_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_flight(self, name: str, content_dict: dict) -> str:
+        flight_id = get_flight_id(content_dict)
+        self.names[name] = flight_id
+        if flight_id in self.flights:
+            return flight_id
+
+        flight = {"meta": {}, "times": [], "sections": {}}
+        for prefix, section in content_dict.items():
+            if not isinstance(section, dict):
+                flight["meta"][prefix] = section
+                continue
+
+            # keys of the same message usually share their timestamps, store them once
+            time_columns = {}
+            flight["sections"][prefix] = {}
+            for key, samples in section.items():
+                times = [s[0] for s in samples]
+                values = [s[1] for s in samples]
+
+                times_raw = encode_times(times)
+                if times_raw not in time_columns:
+                    time_columns[times_raw] = len(flight["times"])
+                    flight["times"].append(self.write_time_chunks(times))
+
+                encoding = get_values_encoding(values)
+                flight["sections"][prefix][key] = {
+                    "times": time_columns[times_raw],
+                    "encoding": encoding,
+                    "chunks": self.write_value_chunks(values, encoding),
+                }
+
+        self.flights[flight_id] = flight
+        return flight_id
+
+    def write_chunk(self, data: bytes) -> list:
+        offset = self.file.tell()
+        compressed = self.compress(data)
+        self.file.write(compressed)
+        return [offset, len(compressed)]
+
+    def write_time_chunks(self, times: list) -> list:
+        chunks = []
+        for i in range(0, len(times), self.chunk_size):
+            block = times[i:i + self.chunk_size]
+            chunks.append(self.write_chunk(encode_times(block)) + [len(block), block[0], block[-1]])
+        return chunks
+
+    def write_value_chunks(self, values: list, encoding: str) -> list:
+        chunks = []
+        for i in range(0, len(values), self.chunk_size):
+            block = values[i:i + self.chunk_size]
+            chunks.append(self.write_chunk(encode_values(block, encoding)))
+        return chunks
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        index = {
+            "version": ARCHIVE_VERSION,
+            "codec": self.codec,
+            "chunk_size": self.chunk_size,
+            "names": self.names,
+            "flights": self.flights,
+        }
+        index_raw = zlib.compress(json.dumps(index).encode(), 9)
+        index_offset = self.file.tell()
+        self.file.write(index_raw)
+        self.file.write(struct.pack(ARCHIVE_FOOTER, index_offset, len(index_raw), ARCHIVE_MAGIC))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        # drop the partial archive, keeping any previous one at `path`
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ArchiveReader:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+
+        if self.file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            self.file.close()
+            raise ValueError("Not a flight archive: %s" % path)
+
+        self.file.seek(-struct.calcsize(ARCHIVE_FOOTER), os.SEEK_END)
+        index_offset, index_len, magic = struct.unpack(ARCHIVE_FOOTER, self.file.read(struct.calcsize(ARCHIVE_FOOTER)))
+        if magic != ARCHIVE_MAGIC:
+            self.file.close()
+            raise ValueError("Truncated flight archive: %s" % path)
+
+        self.file.seek(index_offset)
+        index = json.loads(zlib.decompress(self.file.read(index_len)))
+        if index["version"] != ARCHIVE_VERSION:
+            self.file.close()
+            raise ValueError("Unsupported archive version: %s" % index["version"])
+        if index["codec"] not in CODECS:
+            self.file.close()
+            raise ValueError("Archive codec `%s` is not installed" % index["codec"])
+
+        self.codec = index["codec"]
+        self.decompress = CODECS[self.codec][1]
+        self.names = index["names"]
+        self.flights = index["flights"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def is_current(self) -> bool:
+        # false once `path` points to a different file than the one that is open
+        try:
+            path_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        file_stat = os.fstat(self.file.fileno())
+        return (path_stat.st_dev, path_stat.st_ino) == (file_stat.st_dev, file_stat.st_ino)
+
+    def get_names(self) -> list:
+        return list(self.names.keys())
+
+    def resolve_name(self, name: str) -> str:
+        # accept the full archived path, a file in `logs/`, or a bare file name
+        if name in self.names:
+            return name
+        if "logs/{}".format(name) in self.names:
+            return "logs/{}".format(name)
+        for archived_name in self.names:
+            if os.path.basename(archived_name) == name:
+                return archived_name
+        return None
+
+    def get_latest_name(self) -> str:
+        names = [n for n in self.names if os.path.basename(n)[:3] == "out" and n[-4:] == ".log"]
+        names.sort(key=os.path.basename, reverse=True)
+        return names[0] if names else None
+
+    def read_chunk(self, chunk: list) -> bytes:
+        self.file.seek(chunk[0])
+        return self.decompress(self.file.read(chunk[1]))
+
+    def get_flight(self, name: str) -> dict:
+        archived_name = self.resolve_name(name)
+        if archived_name is None:
+            raise KeyError("Flight not found in archive: %s" % name)
+        return self.flights[self.names[archived_name]]
+
+    def read_column(self, name: str, prefix: str, key: str, start_ms: int = None, end_ms: int = None) -> list:
+        """
+        Reads a single column, only decoding the chunks that overlap [start_ms, end_ms]
+        :return: list of [time_ms, val]
+        """
+        flight = self.get_flight(name)
+        column = flight["sections"][prefix][key]
+        time_chunks = flight["times"][column["times"]]
+
+        samples = []
+        for time_chunk, value_chunk in zip(time_chunks, column["chunks"]):
+            if start_ms is not None and time_chunk[4] < start_ms:
+                continue
+            if end_ms is not None and time_chunk[3] > end_ms:
+                continue
+
+            times = decode_times(self.read_chunk(time_chunk))
+            values = decode_values(self.read_chunk(value_chunk), column["encoding"])
+            for time_ms, val in zip(times, values):
+                if (start_ms is None or time_ms >= start_ms) and (end_ms is None or time_ms <= end_ms):
+                    samples.append([time_ms, val])
+
+        return samples
+
+    def load_flight(self, name: str) -> dict:
+        """
+        Decodes a full flight into the same dict layout as a json log file
+        """
+        flight = self.get_flight(name)
+        time_cache = {}
+        content_dict = {}
+
+        for prefix, section in flight["sections"].items():
+            content_dict[prefix] = {}
+            for key, column in section.items():
+                time_id = column["times"]
+                if time_id not in time_cache:
+                    time_cache[time_id] = []
+                    for time_chunk in flight["times"][time_id]:
+                        time_cache[time_id] += decode_times(self.read_chunk(time_chunk))
+
+                values = []
+                for value_chunk in column["chunks"]:
+                    values += decode_values(self.read_chunk(value_chunk), column["encoding"])
+
+                content_dict[prefix][key] = [[t, v] for t, v in zip(time_cache[time_id], values)]
+
+        content_dict.update(flight["meta"])
+        return content_dict
+
+
+def migrate_log_dirs(log_dirs: list = LOG_DIRS, path: str = ARCHIVE_FILE, codec: str = None) -> dict:
+    """
+    Packs every json log in the given directories into a single archive, storing
+    identical flights once, and reports the compression ratio and decode throughput
+    """
+    raw_size = 0
+    unique_raw_size = 0
+    json_time = 0
+    file_count = 0
+
+    with ArchiveWriter(path, codec) as writer:
+        for log_dir in log_dirs:
+            if not os.path.isdir(log_dir):
+                continue
+
+            for filename in sorted(os.listdir(log_dir)):
+                if filename[:3] != "out" or filename[-4:] != ".log":
+                    continue
+
+                with open("{}/{}".format(log_dir, filename), "r") as file:
+                    content_str = file.read()
+
+                start = perf_counter()
+                content_dict = json.loads(content_str)
+                json_time += perf_counter() - start
+
+                flight_count = len(writer.flights)
+                writer.add_flight("{}/{}".format(log_dir, filename), content_dict)
+                if len(writer.flights) > flight_count:
+                    unique_raw_size += len(content_str)
+                raw_size += len(content_str)
+                file_count += 1
+
+        flight_count = len(writer.flights)
+        codec = writer.codec
+
+    archive_size = os.path.getsize(path)
+
+    # decode every unique flight once to measure the read throughput
+    sample_count = 0
+    with ArchiveReader(path) as reader:
+        names = {}
+        for name, flight_id in reader.names.items():
+            names.setdefault(flight_id, name)
+
+        start = perf_counter()
+        for name in names.values():
+            content_dict = reader.load_flight(name)
+            sample_count += sum(len(l) for s in content_dict.values() if isinstance(s, dict) for l in s.values())
+        decode_time = perf_counter() - start
+
+    stats = {
+        "files": file_count,
+        "flights": flight_count,
+        "codec": codec,
+        "raw_bytes": raw_size,
+        "unique_raw_bytes": unique_raw_size,
+        "archive_bytes": archive_size,
+        "dedup_ratio": raw_size / unique_raw_size if unique_raw_size else 0,
+        "ratio": unique_raw_size / archive_size if archive_size else 0,
+        "samples": sample_count,
+        "decode_sec": decode_time,
+        "json_decode_sec": json_time,
+    }
+
+    print("Archived %d log files as %d unique flights to %s (codec: %s)" % (file_count, flight_count, path, codec))
+    print("Dedup: %d -> %d bytes (%.1fx)" % (raw_size, unique_raw_size, stats["dedup_ratio"]))
+    print("Compression: %d -> %d bytes (%.1fx)" % (unique_raw_size, archive_size, stats["ratio"]))
+    if decode_time > 0:
+        print("Decode: %d samples in %.3f sec (%.0f samples/sec, %.1f MB/sec of json equivalent)"
+              % (sample_count, decode_time, sample_count / decode_time, unique_raw_size / decode_time / 1e6))
+    print("JSON decode of all log files: %.3f sec" % json_time)
+
+    return stats
@@ -0,0 +1,271 @@
+import asyncio
+import signal
+import sys
+from threading import Lock
+from time import perf_counter
+
+from constants import *
+from reader import Reader
+
+
+class AsyncReader(Reader):
+    """
+    Reader variant that receives datagrams on an asyncio event loop and fans the
+    parsed samples out to concurrent consumers, each behind its own bounded queue.
+    A full queue pauses the ingest (the socket buffer absorbs the burst) instead
+    of growing without limit. Samples are always persisted into the log dicts.
+    """
+
+    def __init__(self, lock: Lock, queue_size: int = ASYNC_QUEUE_SIZE):
+        super().__init__(lock)
+        self.queue_size = queue_size
+        self.consumers = {"persistence": self.persist_sample}
+        self.queues = {}
+        self.queue_peaks = {}
+        self.failed_consumers = set()
+        self.backpressure_time = 0
+        self.stop_event = None
+
+    def add_consumer(self, name: str, consumer):
+        """
+        :param name:
+        :param consumer: coroutine function called with every (prefix, time_ms, values) sample
+        :return:
+        """
+        self.consumers[name] = consumer
+
+    async def persist_sample(self, sample: tuple):
+        # counted as ingest, so the cost per message matches the threaded `run_main_loop`
+        start = perf_counter()
+        self.store_sample(*sample)
+        self.ingest_time += perf_counter() - start
+
+    async def read(self, duration: int):
+        """
+        Reads for the given number of seconds, or until SIGINT / SIGTERM
+        """
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.queues = {name: asyncio.Queue(self.queue_size) for name in self.consumers}
+        self.queue_peaks = {name: 0 for name in self.consumers}
+        self.failed_consumers = set()
+
+        signals = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop_event.set)
+                signals.append(sig)
+            except (NotImplementedError, RuntimeError):
+                # not supported by the event loop on this platform
+                pass
+
+        consumer_tasks = [asyncio.create_task(self.consume_loop(name, self.queues[name], consumer))
+                          for name, consumer in self.consumers.items()]
+        persistence_task = consumer_tasks[list(self.consumers).index("persistence")]
+        producer_tasks = [
+            asyncio.create_task(self.ingest_loop()),
+            asyncio.create_task(self.countdown_loop(duration)),
+            asyncio.create_task(self.read_key_stroke_async()),
+        ]
+
+        loop_start = perf_counter()
+        stop_task = asyncio.create_task(self.stop_event.wait())
+        # live consumers can fail on their own, only losing the persistence ends the read
+        await asyncio.wait([stop_task, producer_tasks[0], persistence_task], return_when=asyncio.FIRST_COMPLETED)
+
+        # stop reading, then let the consumers drain what is already queued
+        self.run = False
+        stop_task.cancel()
+        for task in producer_tasks:
+            task.cancel()
+        results = await asyncio.gather(*producer_tasks, return_exceptions=True)
+
+        for name, task in zip(self.consumers, consumer_tasks):
+            if not task.done():
+                await self.queues[name].put(None)
+        results += await asyncio.gather(*consumer_tasks, return_exceptions=True)
+        self.ingest_wall_time = perf_counter() - loop_start
+
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                raise result
+
+    async def ingest_loop(self):
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = self.connection.port.fileno()
+        loop.add_reader(fd, readable.set)
+
+        try:
+            while self.run:
+                await readable.wait()
+                readable.clear()
+
+                # drain everything that is buffered, the socket is non-blocking
+                start = perf_counter()
+                waited = 0
+                while self.run:
+                    mavlink_msg = self.connection.recv_match(type="STATUSTEXT", blocking=False)
+                    if mavlink_msg is None:
+                        break
+                    if len(mavlink_msg.text) < 8:
+                        continue
+
+                    self.msg_count += 1
+                    sample = self.parse_msg(mavlink_msg.text)
+                    if sample is not None:
+                        waited += await self.publish(sample)
+
+                self.ingest_time += perf_counter() - start - waited
+        finally:
+            loop.remove_reader(fd)
+
+    async def publish(self, sample: tuple) -> float:
+        """
+        :return: the time spent waiting on full queues (backpressure)
+        """
+        waited = 0
+        for name, queue in self.queues.items():
+            if name in self.failed_consumers:
+                continue
+            if queue.full():
+                start = perf_counter()
+                await queue.put(sample)
+                waited += perf_counter() - start
+            else:
+                queue.put_nowait(sample)
+            self.queue_peaks[name] = max(self.queue_peaks[name], queue.qsize())
+
+        self.backpressure_time += waited
+        return waited
+
+    async def consume_loop(self, name: str, queue: asyncio.Queue, consumer):
+        while True:
+            sample = await queue.get()
+            if sample is None:
+                return
+            if name in self.failed_consumers:
+                # keep draining, so a pending `publish` on a full queue can't block the ingest
+                continue
+
+            try:
+                await consumer(sample)
+            except Exception as e:
+                if name == "persistence":
+                    raise
+                print("Consumer `%s` failed, no longer feeding it: %r" % (name, e))
+                self.failed_consumers.add(name)
+
+    async def countdown_loop(self, duration: int):
+        time = duration
+        while time > 0:
+            if time % 5 == 0:
+                print("Reading for %d sec" % time)
+            self.curr_time = (duration - time)
+            await asyncio.sleep(1)
+            time -= 1
+
+        self.stop_event.set()
+
+    async def read_key_stroke_async(self):
+        loop = asyncio.get_running_loop()
+        pressed = asyncio.Event()
+
+        try:
+            loop.add_reader(sys.stdin.fileno(), pressed.set)
+        except (NotImplementedError, OSError, ValueError):
+            print("Key strokes are not supported for this input")
+            return
+
+        try:
+            print("Press any key...")
+            await pressed.wait()
+            if not sys.stdin.readline():
+                # stdin is closed, there are no key strokes to wait for
+                return
+            self.spf_time = self.curr_time
+            print("NOW", self.spf_time)
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+
+    def print_ingest_stats(self):
+        super().print_ingest_stats()
+        print("Backpressure: %.3f sec, queue peaks: %s (size %d)" % (self.backpressure_time, self.queue_peaks, self.queue_size))
+        if self.failed_consumers:
+            print("Failed consumers: %s" % ", ".join(sorted(self.failed_consumers)))
+
+
+class Detector:
+    """
+    Live consumer that flags inhibited / GPS differences above the thresholds
+    """
+
+    def __init__(self, thresholds: dict = SPF_THRESHOLDS):
+        self.thresholds = thresholds
+        self.inhibited = {}
+        self.gps = {}
+        self.last_time = 0
+        self.init_alt = 0
+
+    async def consume(self, sample: tuple):
+        prefix, time_ms, values = sample
+        if prefix == PREFIX_INIT_ALT:
+            self.init_alt = values[0]
+            return
+
+        if time_ms <= self.last_time:
+            # messages are sent twice, only compare the first copy
+            return
+
+        if prefix == PREFIX_EKF_I:
+            self.inhibited[time_ms] = dict(zip(SAMPLE_KEYS[prefix], values))
+        elif prefix == PREFIX_GPS:
+            self.gps[time_ms] = dict(zip(SAMPLE_KEYS[prefix], values))
+        else:
+            return
+
+        if time_ms not in self.inhibited or time_ms not in self.gps:
+            return
+
+        inhibited = self.inhibited.pop(time_ms)
+        gps = self.gps.pop(time_ms)
+        self.last_time = time_ms
+
+        # same correction as `Reader.load_log_file`
+        if self.init_alt > 0:
+            gps[ALTITUDE] -= self.init_alt
+
+        exceeded = [key for key, threshold in self.thresholds.items() if abs(inhibited[key] - gps[key]) > threshold]
+        if exceeded:
+            print("[%d] Threshold exceeded: %s" % (time_ms, ", ".join(exceeded)))
+
+        # samples without a match are never paired later, don't keep them around
+        self.inhibited = {t: v for t, v in self.inhibited.items() if t > time_ms}
+        self.gps = {t: v for t, v in self.gps.items() if t > time_ms}
+
+
+class Dashboard:
+    """
+    Live consumer that prints the latest values of every message type
+    """
+
+    def __init__(self, interval: float = DASHBOARD_INTERVAL_S):
+        self.interval = interval
+        self.latest = {}
+        self.last_print = 0
+
+    async def consume(self, sample: tuple):
+        prefix, time_ms, values = sample
+        if prefix == PREFIX_INIT_ALT:
+            return
+
+        self.latest[prefix] = (time_ms, values)
+        now = perf_counter()
+        if now - self.last_print < self.interval:
+            return
+
+        self.last_print = now
+        print(" | ".join("%s[%d] %s" % (p, t, ";".join("%d" % v for v in vals)) for p, (t, vals) in self.latest.items()))
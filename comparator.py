@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from threading import Lock
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from constants import *
+from reader import Reader
+
+# per-process comparator of the pool workers, see `init_worker`
+worker_comparator = None
+
+
+def init_worker(align: str, bin_ms: int, window_ms: tuple, archive: str):
+    global worker_comparator
+    worker_comparator = Comparator(align, bin_ms, window_ms, 1, archive)
+
+    # pool workers exit without running `atexit`, close the archive on the worker shutdown instead
+    Finalize(worker_comparator, worker_comparator.close, exitpriority=10)
+
+
+def get_worker_residuals(log_file: str) -> tuple:
+    return worker_comparator.get_flight_residuals(log_file)
+
+
+class Comparator:
+    """
+    Overlays many flights at once: every flight is reduced to its inhibited/GPS
+    residuals, binned on a shared time axis relative to spoof onset or takeoff,
+    so only one small row per flight and key is kept instead of the raw logs.
+    """
+
+    def __init__(self, align: str = ALIGN_SPOOF, bin_ms: int = COMPARE_BIN_MS, window_ms: tuple = COMPARE_WINDOW_MS,
+                 max_workers: int = COMPARE_MAX_WORKERS, archive: str = None):
+        if align not in (ALIGN_SPOOF, ALIGN_TAKEOFF):
+            raise ValueError("Unsupported alignment: %s" % align)
+
+        self.align = align
+        self.bin_ms = bin_ms
+        self.window_ms = window_ms
+        self.max_workers = max_workers
+        self.archive = archive
+
+        # one reader for every flight, so an archive index is only parsed once
+        self.reader = Reader(Lock())
+        self.bin_times = np.arange(window_ms[0], window_ms[1], bin_ms)
+        self.flights = []
+        self.flight_ids = set()
+        self.residuals = {key: np.empty((0, len(self.bin_times)), dtype=np.float32) for key in RESIDUAL_KEYS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.reader.close_archives()
+
+    def load_flights(self, log_files: list) -> int:
+        """
+        Loads the given flights in worker processes, keeping only their binned residuals
+        :param log_files: log file names (in `logs/`, or in the archive)
+        :return: the number of flights loaded so far
+        """
+        if self.archive is not None:
+            # flight ids are known from the archive index, don't load copies at all
+            log_files = self.get_unique_flights(log_files)
+        workers = self.max_workers or os.cpu_count() or 1
+
+        if workers == 1 or len(log_files) < 2:
+            self.add_residuals(map(self.get_flight_residuals, log_files))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(self.align, self.bin_ms, self.window_ms, self.archive)) as executor:
+                chunk_size = max(1, len(log_files) // (workers * 4))
+                self.add_residuals(executor.map(get_worker_residuals, log_files, chunksize=chunk_size))
+
+        return len(self.flights)
+
+    def add_residuals(self, results):
+        rows = {key: [] for key in RESIDUAL_KEYS}
+        skipped = []
+        duplicates = 0
+
+        for log_file, flight_id, flight_residuals in results:
+            if flight_residuals is None:
+                skipped.append(log_file)
+                continue
+
+            # copies of the same flight would be counted several times in the statistics
+            if flight_id in self.flight_ids:
+                duplicates += 1
+                continue
+
+            self.flights.append(log_file)
+            self.flight_ids.add(flight_id)
+            for key in RESIDUAL_KEYS:
+                rows[key].append(flight_residuals[key])
+
+        for key in RESIDUAL_KEYS:
+            if rows[key]:
+                self.residuals[key] = np.vstack([self.residuals[key]] + rows[key])
+
+        if duplicates:
+            print("Ignoring %d duplicate flights" % duplicates)
+        if skipped:
+            print("Skipped %d flights (legacy layout or no %s reference): %s" % (len(skipped), self.align, ", ".join(skipped)))
+
+    def get_unique_flights(self, log_files: list) -> list:
+        archive_reader = self.reader.get_archive_reader(self.archive)
+        flight_ids = set(self.flight_ids)
+        unique = []
+        for log_file in log_files:
+            name = archive_reader.resolve_name(log_file)
+            flight_id = archive_reader.names[name] if name is not None else log_file
+            if flight_id not in flight_ids:
+                flight_ids.add(flight_id)
+                unique.append(log_file)
+
+        if len(unique) < len(log_files):
+            print("Ignoring %d duplicate flights" % (len(log_files) - len(unique)))
+        return unique
+
+    def get_flight_residuals(self, log_file: str) -> tuple:
+        """
+        :return: (log_file, flight_id, residuals by key), residuals are None if the flight can't be aligned
+        """
+        r = self.reader
+        try:
+            if self.archive is not None:
+                archive_reader = r.get_archive_reader(self.archive)
+                name = archive_reader.resolve_name(log_file)
+                flight_id = archive_reader.names[name] if name is not None else log_file
+                r.load_log_file(log_file, self.archive)
+            else:
+                # hash the bytes that are parsed, so every log file is only read once
+                with open("logs/{}".format(log_file), "rb") as file:
+                    content = file.read()
+                flight_id = hashlib.sha1(content).hexdigest()
+                r.load_log_content(json.loads(content))
+        except KeyError:
+            # legacy log layout without inhibited/uninhibited sections
+            return log_file, None, None
+
+        ref_time = self.get_reference_time(r)
+        if ref_time is None:
+            return log_file, flight_id, None
+
+        flight_residuals = {}
+        for key in RESIDUAL_KEYS:
+            inhibited = np.asarray(r.get_inhibited_log_by_key(key), dtype=np.float64).reshape(-1, 2)
+            gps = np.asarray(r.get_gps_log_by_key(key), dtype=np.float64).reshape(-1, 2)
+            flight_residuals[key] = self.bin_residuals(inhibited, gps, ref_time)
+
+        return log_file, flight_id, flight_residuals
+
+    def get_reference_time(self, r: Reader):
+        gps_alt = r.get_gps_log_by_key(ALTITUDE)
+        if len(gps_alt) == 0:
+            return None
+
+        if self.align == ALIGN_SPOOF:
+            # same reference as the spoofing markers in `Analyzer.create_comparison_plot`
+            if r.spf_time:
+                return gps_alt[0][0] + (r.spf_time * 1000)
+
+            spf_gsd = r.get_spf_log_by_key(GROUND_SPEED_DIFF)
+            return spf_gsd[0][0] if len(spf_gsd) > 0 else None
+
+        # takeoff: the first GPS altitude sample above the ground level
+        ground_alt = gps_alt[0][1]
+        for time_ms, alt in gps_alt:
+            if alt - ground_alt > TAKEOFF_ALT_CM:
+                return time_ms
+        return None
+
+    def bin_residuals(self, inhibited: np.ndarray, gps: np.ndarray, ref_time: float) -> np.ndarray:
+        """
+        Matches inhibited and GPS samples by timestamp and averages their difference per bin
+        :return: array of residuals per bin, NaN where the flight has no data
+        """
+        binned = np.full(len(self.bin_times), np.nan, dtype=np.float32)
+        if len(inhibited) == 0 or len(gps) == 0:
+            return binned
+
+        # the last GPS value for every timestamp, like `Analyzer.get_time_dict`
+        gps_times, gps_index = np.unique(gps[::-1, 0], return_index=True)
+        gps_vals = gps[::-1, 1][gps_index]
+
+        pos = np.clip(np.searchsorted(gps_times, inhibited[:, 0]), 0, len(gps_times) - 1)
+        matched = gps_times[pos] == inhibited[:, 0]
+
+        times = inhibited[matched, 0] - ref_time
+        diffs = inhibited[matched, 1] - gps_vals[pos[matched]]
+
+        bins = np.floor((times - self.window_ms[0]) / self.bin_ms).astype(np.int64)
+        in_window = (bins >= 0) & (bins < len(self.bin_times))
+        bins = bins[in_window]
+        diffs = diffs[in_window]
+
+        counts = np.bincount(bins, minlength=len(self.bin_times))
+        sums = np.bincount(bins, weights=diffs, minlength=len(self.bin_times))
+        has_data = counts > 0
+        binned[has_data] = sums[has_data] / counts[has_data]
+        return binned
+
+    def get_ensemble_stats(self, key: str, percentiles: tuple = COMPARE_PERCENTILES) -> dict:
+        """
+        Per-bin statistics across all loaded flights
+        :return: dict of arrays (one value per bin): mean, min, max, count and the percentiles
+        """
+        residuals = self.residuals[key]
+
+        # bins without any flight data are expected outside of the shortest flights
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            stats = {
+                "mean": np.nanmean(residuals, axis=0),
+                "min": np.nanmin(residuals, axis=0),
+                "max": np.nanmax(residuals, axis=0),
+                "count": np.sum(~np.isnan(residuals), axis=0),
+            }
+            for p, vals in zip(percentiles, np.nanpercentile(residuals, percentiles, axis=0)):
+                stats["p%d" % p] = vals
+
+        return stats
+
+    def show_overlays(self, percentiles: tuple = COMPARE_PERCENTILES, show_flights: bool = True):
+        if len(self.flights) == 0:
+            print("No flights to compare")
+            return
+
+        for key in RESIDUAL_KEYS:
+            residuals = self.residuals[key]
+            if np.all(np.isnan(residuals)):
+                continue
+
+            # flights without any data for this key don't count
+            flight_count = np.any(~np.isnan(residuals), axis=1).sum()
+            stats = self.get_ensemble_stats(key, percentiles)
+            print("%s: %d flights, max |mean residual| %.1f" % (key.ljust(3), flight_count, np.nanmax(np.abs(stats["mean"]))))
+
+            if show_flights:
+                plt.plot(self.bin_times, residuals.T, color="gray", linewidth=0.5, alpha=0.3)
+
+            plt.fill_between(self.bin_times, stats["min"], stats["max"], color="blue", alpha=0.1, label="Min / Max")
+            plt.fill_between(self.bin_times, stats["p%d" % percentiles[0]], stats["p%d" % percentiles[-1]], color="blue",
+                             alpha=0.3, label="P%d - P%d" % (percentiles[0], percentiles[-1]))
+            plt.plot(self.bin_times, stats["mean"], color="red", label="Mean", markersize=4, marker='o')
+            plt.axvline(x=0, color="black", linestyle='dashed')
+
+            plt.xlabel("Time from %s (ms)" % ("spoof onset" if self.align == ALIGN_SPOOF else "takeoff"))
+            plt.ylabel("Inhibited - GPS Residual")
+            plt.title("{} Residual ({} flights)".format(key, flight_count))
+            plt.legend()
+            plt.show()
@@ -35,3 +35,32 @@ REGEX_GPS = "\[(.+)\](.+);(.+);(.+);(.+);(.+);(.+)"  # "G[%lu]%d;%u;%d;%d;%d;%d"
 REGEX_SPF = "\[(.+)\](.+);(.+);(.+);(.+);(.+)"  # "SPF[%lu]%d;%d;%d;%d;%d": gs_diff, vx_diff, vy_diff, vz_diff, alt_diff
 
 REGEX_INIT_ALT = "Setting GPS Initial Altitude: (.+) cm"
+
+LOG_DIRS = ["logs", "logs_old", "logs_old_2", "logs_old_3", "logs_old_4", "logs_old_5", "logs_star", "logs_thresholds"]
+
+ARCHIVE_FILE = "logs_archive/flights.apla"
+ARCHIVE_CHUNK_SIZE = 128  # samples per compressed block
+
+ALIGN_SPOOF = "spoof"
+ALIGN_TAKEOFF = "takeoff"
+TAKEOFF_ALT_CM = 50
+
+RESIDUAL_KEYS = [GROUND_SPEED, VELOCITY_X, VELOCITY_Y, VELOCITY_Z, ALTITUDE]
+
+COMPARE_BIN_MS = 1000
+COMPARE_WINDOW_MS = (-30000, 60000)  # relative to the alignment reference
+COMPARE_PERCENTILES = (25, 75)
+COMPARE_MAX_WORKERS = None  # worker processes, defaults to the cpu count
+
+SAMPLE_KEYS = {
+    PREFIX_EKF_U: [GROUND_SPEED, VELOCITY_X, VELOCITY_Y, VELOCITY_Z, ALTITUDE],
+    PREFIX_EKF_I: [GROUND_SPEED, VELOCITY_X, VELOCITY_Y, VELOCITY_Z, ALTITUDE],
+    PREFIX_GPS: [GROUND_SPEED, SAT_COUNT, VELOCITY_X, VELOCITY_Y, VELOCITY_Z, ALTITUDE],
+    PREFIX_SPF: [GROUND_SPEED_DIFF, VELOCITY_X_DIFF, VELOCITY_Y_DIFF, VELOCITY_Z_DIFF, ALTITUDE_DIFF],
+}
+
+# AVG SQS thresholds (28 April 2021), see `read_mavlink.py`
+SPF_THRESHOLDS = {GROUND_SPEED: 69, VELOCITY_X: 83, VELOCITY_Y: 64, VELOCITY_Z: 39, ALTITUDE: 259}
+
+ASYNC_QUEUE_SIZE = 1000  # samples per consumer before the ingest waits
+DASHBOARD_INTERVAL_S = 1
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from collections import defaultdict
 from pprint import pprint
@@ -5,6 +6,10 @@ from threading import Thread, Lock
 from time import sleep
 
 from analyzer import Analyzer
+from archive import ArchiveReader, migrate_log_dirs
+from async_reader import AsyncReader, Dashboard, Detector
+from comparator import Comparator
+from constants import ARCHIVE_FILE, ALIGN_SPOOF
 from reader import Reader
 
 
@@ -19,11 +24,15 @@ def main():
     a = Analyzer(r, lock)  # initialize analyzer
 
     read_new_data(r, 40)  # read and store a new flight log
+    # read_new_data_async(AsyncReader(lock), 40)  # read with live detector and dashboard on an event loop
     show_data(r, a)  # load flight log and show graphs
 
     # print_thresholds(r, a)  # print the thresholds
     # create_all_csvs(r, a)  # create CSVs from log
     # show_graphs_for_all_logs(r, a)  # show all flight graphs
+    # migrate_log_dirs()  # pack all log directories into a compressed archive
+    # show_data(r, a, archive=ARCHIVE_FILE)  # load the latest flight from the archive
+    # compare_flights("climb_4000mm_10s", ALIGN_SPOOF)  # overlay all matching flights
 
 
 def create_all_csvs(r: Reader, a: Analyzer):
@@ -97,20 +106,52 @@ def read_new_data(r: Reader, time: int, filename: str = None):
 
     # stop reading / analyzing data
     stop_threads(r, threads)
+    r.print_ingest_stats()
 
     # save the data to a log file
     r.save_log_file(filename)
 
 
+def read_new_data_async(r: AsyncReader, time: int, filename: str = None):
+    # start a connection listening to a UDP port
+    r.setup()
+
+    # read until the time is up (or ctrl-c), fanning samples out to the live consumers
+    r.add_consumer("detector", Detector().consume)
+    r.add_consumer("dashboard", Dashboard().consume)
+    try:
+        asyncio.run(r.read(time))
+        r.print_ingest_stats()
+    finally:
+        # save the data to a log file, even if reading failed
+        r.save_log_file(filename)
+
+
 def show_graphs_for_all_logs(r: Reader, a: Analyzer):
     for log in get_all_log_files():
         show_data(r, a, log)
         input("Press any key to continue...")
 
 
-def show_data(r: Reader, a: Analyzer, log_file: str = None):
+def compare_flights(pattern: str = "", align: str = ALIGN_SPOOF, archive: str = None):
+    # overlay every flight whose log name contains the pattern
+    if archive is None:
+        log_files = get_all_log_files()
+    else:
+        with ArchiveReader(archive) as archive_reader:
+            log_files = archive_reader.get_names()
+
+    log_files = [f for f in log_files if pattern in f]
+    print("Comparing %d flights matching `%s`" % (len(log_files), pattern))
+
+    with Comparator(align, archive=archive) as c:
+        c.load_flights(log_files)
+    c.show_overlays()
+
+
+def show_data(r: Reader, a: Analyzer, log_file: str = None, archive: str = None):
     # load the given log file, or the latest
-    r.load_log_file(log_file)
+    r.load_log_file(log_file, archive)
 
     print("SPF TIME:", r.spf_time)
 
@@ -148,4 +189,5 @@ def stop_threads(r: Reader, threads: list):
         thread.join()
 
 
-main()
+if __name__ == "__main__":
+    main()
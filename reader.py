@@ -4,9 +4,11 @@ import re
 import socket
 from datetime import datetime
 from threading import Lock
+from time import perf_counter
 
 from pymavlink import mavutil
 
+from archive import ArchiveReader
 from constants import *
 
 
@@ -47,6 +49,10 @@ class Reader:
             ALTITUDE_DIFF: [],
         }
         self.init_alt = 0
+        self.msg_count = 0
+        self.ingest_time = 0
+        self.ingest_wall_time = 0
+        self.archives = {}
 
     def setup(self):
         # start a connection listening to a UDP port
@@ -66,142 +72,73 @@ class Reader:
         self.run = True
 
     def run_main_loop(self):
+        loop_start = perf_counter()
         while self.run:
+            start = perf_counter()
             mavlink_msg = self.connection.recv_match(type="STATUSTEXT", blocking=False)
             if not mavlink_msg or len(mavlink_msg.text) < 8:
                 continue
 
-            text = mavlink_msg.text
-            if text[:len(MSG_PREFIX_INIT_ALT)] == MSG_PREFIX_INIT_ALT:
-                # handle initial altitude messages
-                self.handle_init_alt_msg(text)
+            sample = self.parse_msg(mavlink_msg.text)
+            if sample is not None:
+                self.store_sample(*sample)
 
-            elif text[:len(MSG_PREFIX_SPF)] == MSG_PREFIX_SPF:
-                # handle spoofing alert messages
-                self.handle_spf_msg(text[len(MSG_PREFIX_SPF):])
+            self.msg_count += 1
+            self.ingest_time += perf_counter() - start
 
-            elif text[:len(MSG_PREFIX_EKF_U)] == MSG_PREFIX_EKF_U:
-                # handle fused ahrs ekf (with gps) sensor data messages
-                self.handle_uninhibited_msg(text[len(MSG_PREFIX_EKF_U):])
-
-            elif text[:len(MSG_PREFIX_EKF_I)] == MSG_PREFIX_EKF_I:
-                # handle custom ekf (without gps) sensor data messages
-                self.handle_inhibited_msg(text[len(MSG_PREFIX_EKF_I):])
-
-            elif text[:len(MSG_PREFIX_GPS)] == MSG_PREFIX_GPS:
-                # handle gps data messages
-                self.handle_gps_msg(text[len(MSG_PREFIX_GPS):])
+        self.ingest_wall_time = perf_counter() - loop_start
 
     def stop_main_loop(self):
         self.run = False
 
-    def handle_init_alt_msg(self, text: str):
-        match = re.match(REGEX_INIT_ALT, text)
-        if match is None:
-            return
-
-        groups = match.groups()
-        init_alt_cm = int(groups[0])
-        print("Setting initial altitude to %d cm" % init_alt_cm)
-        self.init_alt = init_alt_cm
-
-    def handle_uninhibited_msg(self, text: str):
+    def parse_msg(self, text: str):
         """
-        "U[%lu]%d;%d;%d;%d;%d", time_ms, f_ground_speed, f_velocity_x, f_velocity_y,
-                    f_velocity_z, f_alt
+        Parses a STATUSTEXT message into a sample, see the REGEX_* constants for the formats
         :param text:
-        :return:
+        :return: (prefix, time_ms, values) or None
         """
-        match = re.match(REGEX_EKF_U, text)
-        if match is None:
-            return
+        if text[:len(MSG_PREFIX_INIT_ALT)] == MSG_PREFIX_INIT_ALT:
+            # handle initial altitude messages
+            match = re.match(REGEX_INIT_ALT, text)
+            if match is None:
+                return None
+            return PREFIX_INIT_ALT, None, [int(match.groups()[0])]
 
-        groups = match.groups()
-        time_ms = int(groups[0])
+        elif text[:len(MSG_PREFIX_SPF)] == MSG_PREFIX_SPF:
+            # handle spoofing alert messages
+            prefix, match = PREFIX_SPF, re.match(REGEX_SPF, text[len(MSG_PREFIX_SPF):])
 
-        gs, vx, vy, vz, alt = [float(x) for x in groups[1:]]
-        self.mutex.acquire()
-        self.uninhibited_data[GROUND_SPEED].append((time_ms, gs))
-        self.uninhibited_data[VELOCITY_X].append((time_ms, vx))
-        self.uninhibited_data[VELOCITY_Y].append((time_ms, vy))
-        self.uninhibited_data[VELOCITY_Z].append((time_ms, vz))
-        self.uninhibited_data[ALTITUDE].append((time_ms, alt))
-        self.mutex.release()
+        elif text[:len(MSG_PREFIX_EKF_U)] == MSG_PREFIX_EKF_U:
+            # handle fused ahrs ekf (with gps) sensor data messages
+            prefix, match = PREFIX_EKF_U, re.match(REGEX_EKF_U, text[len(MSG_PREFIX_EKF_U):])
 
-    def handle_inhibited_msg(self, text: str):
-        """
-        "I[%lu]%d;%d;%d;%d;%d", time_ms, spf_ground_speed, spf_velocity_x, spf_velocity_y,
-                    spf_velocity_z, spf_alt
-        :param text:
-        :return:
-        """
-        match = re.match(REGEX_EKF_I, text)
-        if match is None:
-            return
+        elif text[:len(MSG_PREFIX_EKF_I)] == MSG_PREFIX_EKF_I:
+            # handle custom ekf (without gps) sensor data messages
+            prefix, match = PREFIX_EKF_I, re.match(REGEX_EKF_I, text[len(MSG_PREFIX_EKF_I):])
 
-        groups = match.groups()
-        time_ms = int(groups[0])
+        elif text[:len(MSG_PREFIX_GPS)] == MSG_PREFIX_GPS:
+            # handle gps data messages
+            prefix, match = PREFIX_GPS, re.match(REGEX_GPS, text[len(MSG_PREFIX_GPS):])
 
-        gs, vx, vy, vz, alt = [float(x) for x in groups[1:]]
-        self.mutex.acquire()
-        self.inhibited_data[GROUND_SPEED].append((time_ms, gs))
-        self.inhibited_data[VELOCITY_X].append((time_ms, vx))
-        self.inhibited_data[VELOCITY_Y].append((time_ms, vy))
-        self.inhibited_data[VELOCITY_Z].append((time_ms, vz))
-        self.inhibited_data[ALTITUDE].append((time_ms, alt))
-        self.mutex.release()
+        else:
+            return None
 
-    def handle_gps_msg(self, text: str):
-        """
-        "G[%lu]%d;%u;%d;%d;%d;%d", time_ms, gps_ground_speed, gps_sat_count,
-                    gps_velocity_x, gps_velocity_y, gps_velocity_z, gps_alt
-        :param text:
-        :return:
-        """
-        match = re.match(REGEX_GPS, text)
         if match is None:
-            return
+            return None
 
         groups = match.groups()
-        time_ms = int(groups[0])
-
-        gs, sc, vx, vy, vz, alt = [float(x) for x in groups[1:]]
-        self.mutex.acquire()
-        self.gps_data[GROUND_SPEED].append((time_ms, gs))
-        self.gps_data[SAT_COUNT].append((time_ms, sc))
-        self.gps_data[VELOCITY_X].append((time_ms, vx))
-        self.gps_data[VELOCITY_Y].append((time_ms, vy))
-        self.gps_data[VELOCITY_Z].append((time_ms, vz))
-        self.gps_data[ALTITUDE].append((time_ms, alt))
-        self.mutex.release()
+        return prefix, int(groups[0]), [float(x) for x in groups[1:]]
 
-    def handle_spf_msg(self, text: str):
-        """
-        "SPF[%lu]%d;%d;%d;%d;%d",
-                        time_ms,
-                        defender.spoof_state.ground_speed_diff,
-                        defender.spoof_state.velocity_x_diff,
-                        defender.spoof_state.velocity_y_diff,
-                        defender.spoof_state.velocity_z_diff
-                        defender.spoof_state.altitude_diff
-        :param text:
-        :return:
-        """
-
-        match = re.match(REGEX_SPF, text)
-        if match is None:
+    def store_sample(self, prefix: str, time_ms: int, values: list):
+        if prefix == PREFIX_INIT_ALT:
+            print("Setting initial altitude to %d cm" % values[0])
+            self.init_alt = values[0]
             return
 
-        groups = match.groups()
-        time_ms = int(groups[0])
-
-        gsd, vxd, vyd, vzd, altd = [float(x) for x in groups[1:]]
+        data = self.get_log_full_by_prefix(prefix)
         self.mutex.acquire()
-        self.spf_data[GROUND_SPEED_DIFF].append((time_ms, gsd))
-        self.spf_data[VELOCITY_X_DIFF].append((time_ms, vxd))
-        self.spf_data[VELOCITY_Y_DIFF].append((time_ms, vyd))
-        self.spf_data[VELOCITY_Z_DIFF].append((time_ms, vzd))
-        self.spf_data[ALTITUDE_DIFF].append((time_ms, altd))
+        for key, val in zip(SAMPLE_KEYS[prefix], values):
+            data[key].append((time_ms, val))
         self.mutex.release()
 
     def get_uninhibited_log_by_key(self, data_key: str, start: int = 0) -> list:
@@ -237,6 +174,24 @@ class Reader:
     def get_spf_log_full(self) -> dict:
         return self.spf_data
 
+    def get_log_full_by_prefix(self, prefix: str) -> dict:
+        return {
+            PREFIX_EKF_U: self.uninhibited_data,
+            PREFIX_EKF_I: self.inhibited_data,
+            PREFIX_GPS: self.gps_data,
+            PREFIX_SPF: self.spf_data,
+        }[prefix]
+
+    def print_ingest_stats(self):
+        if self.ingest_wall_time == 0 or self.ingest_time == 0:
+            print("No messages received")
+            return
+
+        busy = self.ingest_time / self.ingest_wall_time
+        print("Ingest: %d messages in %.1f sec (%.1f msg/sec), %.1f us/msg, %.1f%% busy, max %.0f msg/sec"
+              % (self.msg_count, self.ingest_wall_time, self.msg_count / self.ingest_wall_time,
+                 self.ingest_time / max(self.msg_count, 1) * 1e6, busy * 100, self.msg_count / self.ingest_time))
+
     def read_key_stroke_loop(self) -> None:
         while self.run and self.spf_time is None:
             input("Press any key...\n")
@@ -263,25 +218,60 @@ class Reader:
         print("Writing log file: %s" % filename)
         return filename
 
-    def load_log_file(self, filename: str = None):
-        if filename is None:
-            dir_contents = os.listdir("logs")
-            dir_contents.sort(reverse=True)
-
-            for obj in dir_contents:
-                if obj[:3] == "out" and obj[-4:] == ".log":
-                    filename = obj
-                    break
-
-        if filename is None:
-            print("No log files found")
-            return
-
-        print("Loading %s" % filename)
-        with open("logs/{}".format(filename), "r") as file:
-            content_str = file.read()
-            content_dict = json.loads(content_str)
-            self.mutex.acquire()
+    def get_archive_reader(self, archive: str) -> ArchiveReader:
+        # keep archives open, so their index is only parsed once per reader
+        archive_reader = self.archives.get(archive)
+        if archive_reader is not None and not archive_reader.is_current():
+            # the archive was replaced (e.g. by `migrate_log_dirs`), reopen it
+            archive_reader.close()
+            archive_reader = None
+
+        if archive_reader is None:
+            archive_reader = ArchiveReader(archive)
+            self.archives[archive] = archive_reader
+        return archive_reader
+
+    def close_archives(self):
+        for archive_reader in self.archives.values():
+            archive_reader.close()
+        self.archives = {}
+
+    def load_log_file(self, filename: str = None, archive: str = None):
+        if archive is not None:
+            # read the flight from a compressed archive instead of `logs/`
+            archive_reader = self.get_archive_reader(archive)
+            filename = archive_reader.get_latest_name() if filename is None else archive_reader.resolve_name(filename)
+            if filename is None:
+                print("No log files found")
+                return
+
+            print("Loading %s from %s" % (filename, archive))
+            content_dict = archive_reader.load_flight(filename)
+
+        else:
+            if filename is None:
+                dir_contents = os.listdir("logs")
+                dir_contents.sort(reverse=True)
+
+                for obj in dir_contents:
+                    if obj[:3] == "out" and obj[-4:] == ".log":
+                        filename = obj
+                        break
+
+            if filename is None:
+                print("No log files found")
+                return
+
+            print("Loading %s" % filename)
+            with open("logs/{}".format(filename), "r") as file:
+                content_str = file.read()
+                content_dict = json.loads(content_str)
+
+        self.load_log_content(content_dict)
+
+    def load_log_content(self, content_dict: dict):
+        # a legacy log without these sections raises a KeyError, don't leave the lock held
+        with self.mutex:
             self.uninhibited_data = content_dict[PREFIX_EKF_U]
             self.inhibited_data = content_dict[PREFIX_EKF_I]
             self.gps_data = content_dict[PREFIX_GPS]
@@ -292,5 +282,3 @@ class Reader:
             if self.init_alt > 0:
                 print("Updating GPS Initial Altitude to %d cm" % self.init_alt)
                 self.gps_data[ALTITUDE] = [(time, float(alt) - self.init_alt) for time, alt in self.gps_data[ALTITUDE]]
-
-            self.mutex.release()